@@ -1,4 +1,5 @@
 import os
+import re
 import json
 import pandas as pd
 import streamlit as st
@@ -9,12 +10,46 @@ st.set_page_config(page_title="Telegram Rent Finder", layout="wide")
 st.title("Telegram Rent Finder UI")
 st.caption("Filter and export **image-only** listings collected from Telegram.")
 
+def _shrink(df: pd.DataFrame) -> pd.DataFrame:
+    # Repeated channel names become small int codes; numerics use the narrowest dtype
+    if "channel" in df.columns:
+        df["channel"] = df["channel"].astype("category")
+    for col, kind in (("price_usd", "float"), ("score", "integer")):
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], downcast=kind)
+    return df
+
+@st.cache_data(show_spinner=False)
+def load_df(path: str, mtime: float) -> pd.DataFrame:
+    # `mtime` is only the cache key: a new collector write invalidates the entry.
+    # Default C engine on purpose: pyarrow's reader infers date_local as a timestamp,
+    # which would show/export it as "%Y-%m-%d %H:%M:%S" instead of the collector's string.
+    return _shrink(pd.read_csv(
+        path,
+        dtype={"channel": "category", "price_usd": "float32", "score": "Int16"},
+    ))
+
+@st.cache_data(show_spinner=False)
+def load_parquet(path: str, mtime: float) -> pd.DataFrame:
+    return _shrink(pd.read_parquet(path))
+
+@st.cache_data(show_spinner=False)
+def load_sample(path: str) -> pd.DataFrame:
+    with open(path, "r", encoding="utf-8") as f:
+        return _shrink(pd.DataFrame(json.load(f)))
+
 csv_path = "matches.csv"
-if os.path.exists(csv_path) and os.path.getsize(csv_path) > 0:
-    df = pd.read_csv(csv_path)
+parquet_path = "matches.parquet"
+has_csv = os.path.exists(csv_path) and os.path.getsize(csv_path) > 0
+# The Parquet file is only a snapshot of the CSV, refreshed at the end of each run.
+# Use it only while the CSV exists and is not newer (a newer CSV means a run is in
+# progress or pyarrow is missing); a deleted/emptied CSV means results were reset.
+if has_csv and os.path.exists(parquet_path) and os.path.getmtime(parquet_path) >= os.path.getmtime(csv_path):
+    df = load_parquet(parquet_path, os.path.getmtime(parquet_path))
+elif has_csv:
+    df = load_df(csv_path, os.path.getmtime(csv_path))
 else:
-    with open("data/sample_listings.json", "r", encoding="utf-8") as f:
-        df = pd.DataFrame(json.load(f))
+    df = load_sample("data/sample_listings.json")
 
 for col in ["channel","message_id","date_local","price_usd","score","url","text"]:
     if col not in df.columns:
@@ -28,11 +63,18 @@ smin, smax = st.sidebar.slider("Score", 0, 10, (0, 10), step=1)
 query = st.sidebar.text_input("Search text (regex ok)", "")
 only_links = st.sidebar.checkbox("Only with a post URL", value=True)
 
-mask = (df["price_usd"].fillna(0).between(pmin, pmax)) & (df["score"].fillna(0).between(smin, smax))
-if only_links and "url" in df.columns:
-    mask &= df["url"].astype(str).str.len() > 0
-if query.strip():
-    mask &= df["text"].astype(str).str.contains(query, case=False, regex=True)
+price_arr = df["price_usd"].to_numpy(dtype="float32", na_value=0.0)
+score_arr = df["score"].to_numpy(dtype="int16", na_value=0)
+mask = (price_arr >= pmin) & (price_arr <= pmax) & (score_arr >= smin) & (score_arr <= smax)
+if only_links:
+    mask &= df["url"].fillna("").str.len().to_numpy() > 0
+try:
+    pat = re.compile(query, re.I) if query.strip() else None
+except re.error as e:
+    st.sidebar.warning(f"Invalid regex: {e}")
+    pat = None
+if pat is not None:
+    mask &= df["text"].fillna("").str.contains(pat, na=False).to_numpy()
 
 view = df.loc[mask].copy()
 st.subheader(f"Results: {len(view)}")
@@ -15,15 +15,19 @@ import os
 import re
 import csv
 import json
+import time
+import asyncio
 import logging
+import unicodedata
 import datetime as dt
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
-import requests
+import httpx
+import orjson
 from dotenv import load_dotenv
 from telethon import TelegramClient, functions, types
-from telethon.errors import RPCError, SessionPasswordNeededError
+from telethon.errors import FloodWaitError, RPCError, SessionPasswordNeededError
 from telethon.tl.types import Channel, Message
 
 # Env / config
@@ -43,8 +47,11 @@ TERM_MIN_MONTHS = int(os.getenv("TERM_MIN_MONTHS", "6"))
 LLM_PROVIDER = os.getenv("LLM_PROVIDER", "ollama")
 OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434/api/chat")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "qwen2.5:3b-instruct")
+OLLAMA_NUM_PARALLEL = int(os.getenv("OLLAMA_NUM_PARALLEL", "8"))
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "1h")
 
 CSV_PATH = "matches.csv"
+PARQUET_PATH = "matches.parquet"
 LOG_LEVEL = logging.INFO
 
 DISCOVER_KEYWORDS: List[str] = [
@@ -55,6 +62,9 @@ DISCOVER_KEYWORDS: List[str] = [
 DISCOVER_LIMIT_PER_QUERY = 30
 DISCOVER_MIN_SUBS = 300
 DISCOVER_MAX_CHANNELS = 40
+COLLECT_PARALLEL_CHANNELS = 4  # kept low: more concurrent history fetches invite FloodWait
+CHANNEL_CACHE_PATH = ".channel_cache.json"
+CHANNEL_CACHE_TTL = 24 * 3600  # seconds before a channel's subscriber count is re-fetched
 
 OUT_OF_BATUMI = [
     "махинджаури","мaхинджаури","მახინჯაური","gonio","гонио","გონიო","квариати","kvariati",
@@ -76,7 +86,18 @@ TBILISI_TZ = dt.timezone(dt.timedelta(hours=4))
 logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s | %(levelname)s | %(message)s")
 log = logging.getLogger("collector")
 
-@dataclass
+# Shared keep-alive pool for Ollama; the semaphore caps in-flight LLM requests.
+# HTTP/2 is negotiated via ALPN, so it only kicks in when OLLAMA_URL is https.
+_HTTP = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=20, max_connections=40),
+    timeout=30.0,
+)
+_LLM_SEM = asyncio.Semaphore(OLLAMA_NUM_PARALLEL)
+# One LLM task per distinct prompt text for the run: cross-posted listings share it
+_LLM_TASKS: Dict[str, "asyncio.Task[Optional[dict]]"] = {}
+
+@dataclass(slots=True, frozen=True)
 class Listing:
     channel: str
     url: Optional[str]
@@ -88,107 +109,130 @@ class Listing:
 
 EMOJI_DIGITS = {"0️⃣":"0","1️⃣":"1","2️⃣":"2","3️⃣":"3","4️⃣":"4","5️⃣":"5","6️⃣":"6","7️⃣":"7","8️⃣":"8","9️⃣":"9"}
 
+# Emoji keycaps are multi-codepoint, so str.translate can't map them; one alternation can
+_NUM_CURRENCY_MAP = {**EMOJI_DIGITS, "💵":" $ ", "💲":" $ ", "₾":" GEL "}
+_RE_NUM_CURRENCY = re.compile("|".join(map(re.escape, _NUM_CURRENCY_MAP)))
+
 def _norm_nums_currency(text: str) -> str:
-    import unicodedata
-    s = text
-    for emo, d in EMOJI_DIGITS.items():
-        s = s.replace(emo, d)
-    s = unicodedata.normalize("NFKC", s)
-    s = s.replace("💵"," $ ").replace("💲"," $ ").replace("₾"," GEL ")
-    return s
+    s = _RE_NUM_CURRENCY.sub(lambda m: _NUM_CURRENCY_MAP[m.group(0)], text)
+    return unicodedata.normalize("NFKC", s)
+
+_NORM_TRANS = str.maketrans({"х":"x","×":"x","•":"+"})
+_RE_XPLUS = re.compile(r"\s*([x+])\s*")
+# Punctuation -> space and whitespace collapse in one pass
+_RE_NONWORD_WS = re.compile(r"(?:[^\w+#\s-]|\s)+")
+_RE_THREE_ROOM = re.compile(r"\b(тр[её]хкомнат\w*|3-?комнат\w*|\b3к\b|\b3-к\b|\b3\s*room\b|\b3br\b)")
+_RE_DOUBLE_BED = re.compile(r"двуспальн\w+\s+кроват")
+_RE_TWO_BED = re.compile(r"\b(2\s*спальн\w*|две\s*спальн\w*|2\s*bed(room)?s?)\b")
+_RE_DAILY = re.compile(r"\b(сутк|посуточ|per\s*day|daily|ноч[ьи]|за\s*день)\b")
+_RE_PRICE_USD = re.compile(r"(\d[\d \u00A0]{1,6}(?:[.,]\d{1,2})?)\s*(?:\$|usd)\b", re.I)
+_RE_PRICE_GEL = re.compile(r"(\d[\d \u00A0]{1,6}(?:[.,]\d{1,2})?)\s*(?:gel|lari|лари|ლ)\b", re.I)
+_RE_CURRENCY_HINT = re.compile(r"[$₾💵💲]|usd|gel|lari|лари|ლარ|доллар|dollar|бакс", re.I)
 
 def _norm_text(t: str) -> str:
-    s = t.lower()
-    s = s.replace("х","x").replace("×","x").replace("•","+")
-    s = re.sub(r"\s*([x+])\s*","+ ", s)
-    s = re.sub(r"[^\w+#\s-]"," ", s)
-    s = re.sub(r"\s+"," ", s).strip()
-    return s
-
-def _has_one_plus_one(text: str) -> bool:
-    return "1+1" in _norm_text(text)
-
-def _explicit_three_room(text: str) -> bool:
-    s = _norm_text(text)
-    return bool(re.search(r"\b(тр[её]хкомнат\w*|3-?комнат\w*|\b3к\b|\b3-к\b|\b3\s*room\b|\b3br\b)", s))
-
-def _explicit_two_bed(text: str) -> bool:
-    s = _norm_text(text)
-    if re.search(r"двуспальн\w+\s+кроват", s):
+    s = t.lower().translate(_NORM_TRANS)
+    s = _RE_XPLUS.sub("+ ", s)
+    return _RE_NONWORD_WS.sub(" ", s).strip()
+
+# The predicates below take text already passed through _norm_text (once per message)
+def _has_one_plus_one(s: str) -> bool:
+    return "1+1" in s
+
+def _explicit_three_room(s: str) -> bool:
+    return bool(_RE_THREE_ROOM.search(s))
+
+def _explicit_two_bed(s: str) -> bool:
+    if _RE_DOUBLE_BED.search(s):
         return False
-    return _explicit_three_room(s) or bool(re.search(r"\b(2\s*спальн\w*|две\s*спальн\w*|2\s*bed(room)?s?)\b", s))
+    return _explicit_three_room(s) or bool(_RE_TWO_BED.search(s))
 
-def _detect_daily(text: str) -> bool:
-    s = _norm_text(text)
-    return bool(re.search(r"\b(сутк|посуточ|per\s*day|daily|ноч[ьи]|за\s*день)\b", s))
+def _detect_daily(s: str) -> bool:
+    return bool(_RE_DAILY.search(s))
 
-def _mentions(tokens: List[str], text: str) -> bool:
-    s = text.lower()
-    return any(tok in s for tok in tokens)
+def _keywords_re(tokens: List[str]) -> re.Pattern:
+    # One alternation per list: a single C-level scan instead of a substring test per token
+    return re.compile("|".join(map(re.escape, tokens)), re.I)
+
+_RE_OUT_OF_BATUMI = _keywords_re(OUT_OF_BATUMI)
+_RE_EXCLUDE_BUILDINGS = _keywords_re(EXCLUDE_BUILDINGS)
+_RE_PRIORITY_STREETS = _keywords_re(PRIORITY_STREETS)
+
+def _mentions(pat: re.Pattern, text: str) -> bool:
+    return pat.search(text) is not None
 
 def _extract_price_usd(text: str) -> Optional[float]:
     t = _norm_nums_currency(text)
-    m = re.search(r"(\d[\d \u00A0]{1,6}(?:[.,]\d{1,2})?)\s*(?:\$|usd)\b", t, flags=re.I)
+    m = _RE_PRICE_USD.search(t)
     if m:
         v = float(m.group(1).replace(" ","").replace("\u00A0","").replace(",","."))
         return round(v, 2)
-    m = re.search(r"(\d[\d \u00A0]{1,6}(?:[.,]\d{1,2})?)\s*(?:gel|lari|лари|ლ)\b", t, flags=re.I)
+    m = _RE_PRICE_GEL.search(t)
     if m:
         v = float(m.group(1).replace(" ","").replace("\u00A0","").replace(",","."))
         return round(v / GEL_PER_USD, 2)
     return None
 
-def _first_json_object(s: str) -> Optional[str]:
-    depth = 0; start = -1
-    for i, ch in enumerate(s):
-        if ch == "{":
-            if depth == 0: start = i
-            depth += 1
-        elif ch == "}":
-            if depth > 0:
-                depth -= 1
-                if depth == 0 and start != -1:
-                    return s[start:i+1]
+_JSON_DEC = json.JSONDecoder()
+
+def _parse_first_json(s: str) -> Optional[dict]:
+    # Well-behaved replies are exactly one object: orjson parses those directly
+    try:
+        data = orjson.loads(s)
+        if isinstance(data, dict):
+            return data
+    except orjson.JSONDecodeError:
+        pass
+    # Otherwise raw_decode locates the object's end and parses it in one C-level pass
+    i = s.find("{")
+    while i != -1:
+        try:
+            return _JSON_DEC.raw_decode(s, i)[0]
+        except json.JSONDecodeError:
+            i = s.find("{", i + 1)
     return None
 
-def llm_extract(text: str) -> Optional[dict]:
-    if LLM_PROVIDER != "ollama":
-        return None
-    schema = {
-        "accept": False, "reason": "", "price_value": None, "price_currency": "USD", "price_usd": None,
-        "period": "unknown", "term_months": None, "bedrooms_count": None, "two_separate_bedrooms": None,
-        "inner_bedroom": False, "is_magnolia": False, "excluded_location": False, "priority_bonus": 0, "score_10": 0
-    }
-    prompt = f"""
+_LLM_SCHEMA = {
+    "accept": False, "reason": "", "price_value": None, "price_currency": "USD", "price_usd": None,
+    "period": "unknown", "term_months": None, "bedrooms_count": None, "two_separate_bedrooms": None,
+    "inner_bedroom": False, "is_magnolia": False, "excluded_location": False, "priority_bonus": 0, "score_10": 0
+}
+# Byte-identical across requests, so Ollama reuses its KV cache for the whole prefix;
+# only the listing text (the user message) is new per call
+_SYSTEM_MSG = f"""
+Ты детерминированный экстрактор JSON. Отдавай ровно ОДИН minified JSON.
 Strict selection for long-term rent in Batumi (LLM-only). Output ONE-LINE MINIFIED JSON with EXACT keys:
-{json.dumps(schema, ensure_ascii=False, separators=(",", ":"))}
+{orjson.dumps(_LLM_SCHEMA).decode()}
 NEVER accept: price_usd > {USD_MAX}, студия/studio, daily/сутки, Magnolia, outside Batumi,
 "1+1" (ONE bedroom), 2к unless EXPLICIT "2 спальни"/"two bedrooms".
 ACCEPT only if: period="month", {USD_MIN} ≤ price_usd ≤ {USD_MAX}, bedrooms_count ≥ 2, no inner bedroom,
 excluded_location=false, is_magnolia=false, (term_months is null or ≥ {TERM_MIN_MONTHS}).
-Reason must be short Russian. Output ONE minified JSON only.
-Text:
-{text[:6000]}
+Reason must be short Russian. Output ONE minified JSON only. The user message is the listing text.
 """.strip()
+
+async def llm_extract(text: str) -> Optional[dict]:
+    if LLM_PROVIDER != "ollama":
+        return None
     try:
-        r = requests.post(
-            OLLAMA_URL,
-            headers={"Content-Type":"application/json"},
-            data=json.dumps({
-                "model": OLLAMA_MODEL,
-                "messages": [
-                    {"role":"system","content":"Ты детерминированный экстрактор JSON. Отдавай ровно ОДИН minified JSON."},
-                    {"role":"user","content": prompt},
-                ],
-                "options":{"temperature":0,"num_ctx":4096},
-                "stream": False,
-            }),
-            timeout=30,
-        )
+        async with _LLM_SEM:
+            r = await _HTTP.post(
+                OLLAMA_URL,
+                headers={"Content-Type":"application/json"},
+                content=orjson.dumps({
+                    "model": OLLAMA_MODEL,
+                    "messages": [
+                        {"role":"system","content": _SYSTEM_MSG},
+                        {"role":"user","content": text[:6000]},
+                    ],
+                    "options":{"temperature":0,"num_ctx":4096},
+                    "keep_alive": OLLAMA_KEEP_ALIVE,
+                    "stream": False,
+                }),
+            )
         r.raise_for_status()
-        content = r.json()["message"]["content"]
-        blob = _first_json_object(content) or content
-        data = json.loads(blob.strip())
+        content = orjson.loads(r.content)["message"]["content"]
+        data = _parse_first_json(content)
+        if data is None:
+            return None
         if data.get("price_usd") is None and isinstance(data.get("price_value"), (int,float)):
             cur = (data.get("price_currency") or "USD").upper()
             val = float(data["price_value"])
@@ -198,20 +242,111 @@ Text:
         log.debug(f"LLM skip: {e}")
         return None
 
+async def llm_extract_shared(text: str) -> Optional[dict]:
+    key = text[:6000]  # what llm_extract actually sends
+    task = _LLM_TASKS.get(key)
+    if task is None:
+        task = _LLM_TASKS[key] = asyncio.ensure_future(llm_extract(text))
+    return await task
+
+async def _decide(text: str, price_usd: Optional[float]) -> dict:
+    # An in-range regex price on a post that passed the rules is already a decision;
+    # the LLM is only asked when the price is mentioned but the regex can't parse it
+    if price_usd is not None:
+        return {"price_usd": price_usd}
+    return await llm_extract_shared(text) or {}
+
 def _ensure_csv_header(path: str) -> None:
     if not os.path.exists(path) or os.path.getsize(path) == 0:
         with open(path, "w", newline="", encoding="utf-8") as f:
             csv.writer(f).writerow(["match_type","channel","message_id","date_local","price_usd","score","url","text"])
 
-def _append_csv_row(path: str, entry: "Listing") -> None:
-    with open(path, "a", newline="", encoding="utf-8") as f:
-        csv.writer(f).writerow([
-            "strict", entry.channel, entry.message_id, entry.date_local,
-            entry.price_usd, entry.score, entry.url or "", entry.text.replace("\n"," ")[:1800]
-        ])
+def _load_seen(path: str, cutoff: dt.datetime) -> Tuple[set, Dict[str, int]]:
+    # (channel, message_id) pairs already written by earlier runs, plus the highest
+    # such id per channel among rows still inside the lookback window. Older rows
+    # must not set min_id: in reverse mode Telethon lets min_id override offset_date.
+    seen = set()
+    last_ids: Dict[str, int] = {}
+    if not os.path.exists(path):
+        return seen, last_ids
+    with open(path, newline="", encoding="utf-8") as f:
+        r = csv.reader(f)
+        next(r, None)
+        for row in r:
+            if len(row) < 4 or not row[2].isdigit():
+                continue
+            title, msg_id = row[1], int(row[2])
+            seen.add((title, msg_id))
+            try:
+                row_dt = dt.datetime.strptime(row[3], "%Y-%m-%d %H:%M").replace(tzinfo=TBILISI_TZ)
+            except ValueError:
+                continue
+            if row_dt >= cutoff:
+                last_ids[title] = max(last_ids.get(title, 0), msg_id)
+    return seen, last_ids
+
+def _csv_row(entry: "Listing") -> list:
+    return [
+        "strict", entry.channel, entry.message_id, entry.date_local,
+        entry.price_usd, entry.score, entry.url or "", entry.text.replace("\n"," ")[:1800]
+    ]
+
+def _load_channel_cache(path: str) -> dict:
+    try:
+        with open(path, "rb") as f:
+            cache = orjson.loads(f.read())
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+def _cached_subs(entry, now: float) -> Optional[int]:
+    # Stale or malformed entries (hand-edited, partial writes) count as a miss
+    if not isinstance(entry, dict):
+        return None
+    ts, subs = entry.get("ts"), entry.get("subs")
+    if not isinstance(ts, (int, float)) or not isinstance(subs, int) or isinstance(subs, bool) or now - ts >= CHANNEL_CACHE_TTL:
+        return None
+    return subs
+
+def _save_channel_cache(path: str, cache: dict) -> None:
+    with open(path, "wb") as f:
+        f.write(orjson.dumps(cache))
+
+async def _retry_flood_wait(call, ch: Channel):
+    # Sleep out a FloodWait and retry once; only the calling task waits.
+    # A second FloodWait (an RPCError) is left to the caller.
+    try:
+        return await call()
+    except FloodWaitError as e:
+        log.warning(f"FloodWait {e.seconds}с на канале {ch.id}, жду и повторяю")
+        await asyncio.sleep(e.seconds)
+        return await call()
+
+async def _channel_subs(client: TelegramClient, ch: Channel) -> Optional[int]:
+    req = functions.channels.GetFullChannelRequest(channel=types.InputChannel(ch.id, ch.access_hash))
+    try:
+        full = await _retry_flood_wait(lambda: client(req), ch)
+    except RPCError:
+        return None
+    return getattr(full.full_chat, "participants_count", 0) or 0
+
+def _export_parquet(csv_path: str, parquet_path: str) -> None:
+    # Typed columnar snapshot for the UI; CSV stays the append log (Parquet can't append)
+    try:
+        import pandas as pd
+        df = pd.read_csv(csv_path, dtype={"channel": "category", "price_usd": "float32", "score": "Int16"})
+        tmp = parquet_path + ".tmp"
+        df.to_parquet(tmp, engine="pyarrow", compression="zstd", index=False)
+        os.replace(tmp, parquet_path)  # the UI never sees a half-written file
+    except (ImportError, ValueError, OSError) as e:
+        # Optional snapshot: a missing dependency, an unparsable CSV or a file locked
+        # by the UI (Windows) must not fail a finished run
+        log.info(f"Parquet не записан ({e}), UI прочитает CSV")
 
 async def discover_channels(client: TelegramClient) -> List[Channel]:
     found = {}
+    cache = _load_channel_cache(CHANNEL_CACHE_PATH)
+    now = time.time()
     for kw in DISCOVER_KEYWORDS:
         try:
             res = await client(functions.contacts.SearchRequest(q=kw, limit=DISCOVER_LIMIT_PER_QUERY))
@@ -221,88 +356,127 @@ async def discover_channels(client: TelegramClient) -> List[Channel]:
         for ch in res.chats:
             if not isinstance(ch, Channel):
                 continue
-            try:
-                full = await client(functions.channels.GetFullChannelRequest(channel=types.InputChannel(ch.id, ch.access_hash)))
-                subs = getattr(full.full_chat, "participants_count", 0) or 0
-            except RPCError:
-                subs = 0
+            subs = _cached_subs(cache.get(str(ch.id)), now)
+            if subs is None:
+                subs = await _channel_subs(client, ch)
+                if subs is None:
+                    subs = 0  # failed lookups are not cached, retry next run
+                else:
+                    cache[str(ch.id)] = {"subs": subs, "ts": now}
             if subs >= DISCOVER_MIN_SUBS:
                 found[ch.id] = ch
         if len(found) >= DISCOVER_MAX_CHANNELS:
             break
+    _save_channel_cache(CHANNEL_CACHE_PATH, cache)
     selected = list(found.values())[:DISCOVER_MAX_CHANNELS]
-    log.info(f"Дискавер: выбрано каналов = {len(selected)} (мин. подписчиков: {DISCOVER_MIN_SUBС})")
+    log.info(f"Дискавер: выбрано каналов = {len(selected)} (мин. подписчиков: {DISCOVER_MIN_SUBS})")
     return selected
 
-async def collect(client: TelegramClient) -> None:
-    cutoff = dt.datetime.now(UTC) - dt.timedelta(days=LOOKBACK_DAYS)
-    _ensure_csv_header(CSV_PATH)
-    channels = await discover_channels(client)
+async def _collect_channel(client: TelegramClient, ch: Channel, cutoff: dt.datetime,
+                           seen: set, last_ids: Dict[str, int]) -> List[Listing]:
+    title = getattr(ch, "username", None) or getattr(ch, "title","") or str(getattr(ch, "id",""))
+    processed = 0
+    candidates = []
+    entries = []
+
+    # Walk forward from the cutoff: Telegram filters by date server-side and
+    # busy channels are no longer truncated at a fixed message count. Rows are only
+    # written once a channel is done, so min_id (its last saved id) lets a rerun
+    # fetch only the new tail. Trade-off: a post before that id whose LLM call
+    # failed (e.g. Ollama was down) is not retried on later runs.
+    async for msg in client.iter_messages(ch, offset_date=cutoff, reverse=True, min_id=last_ids.get(title, 0)):
+        if not isinstance(msg, Message) or not getattr(msg, "date", None):
+            continue
+        if (title, msg.id) in seen:
+            continue
 
-    log.info(f"Сбор из {len(channels)} каналов, период {LOOKBACK_DAYS}д, только посты с фото")
-    for ch in channels:
-        title = getattr(ch, "username", None) or getattr(ch, "title","") or str(getattr(ch, "id",""))
-        processed = kept = 0
+        msg_dt = msg.date if msg.date.tzinfo else msg.date.replace(tzinfo=UTC)
+        # Reverse iteration has no client-side date check and min_id takes priority
+        # over offset_date, so enforce the window here
+        if msg_dt < cutoff:
+            continue
 
-        async for msg in client.iter_messages(ch, limit=1200):
-            if not isinstance(msg, Message) or not getattr(msg, "date", None):
-                continue
+        if not getattr(msg, "photo", None):
+            continue
 
-            msg_dt = msg.date if msg.date.tzinfo else msg.date.replace(tzinfo=UTC)
-            if msg_dt.astimezone(UTC) < cutoff:
-                break
+        text = (getattr(msg, "message", None) or "").strip()
+        if not text:
+            continue
 
-            if not getattr(msg, "photo", None):
-                continue
+        processed += 1
 
-            text = (getattr(msg, "message", None) or "").strip()
-            if not text:
-                continue
+        # Cheap rules first: only survivors are worth an LLM round-trip
+        s_norm = _norm_text(text)
+        if (_has_one_plus_one(s_norm) or _detect_daily(s_norm)
+                or _mentions(_RE_OUT_OF_BATUMI, text) or _mentions(_RE_EXCLUDE_BUILDINGS, text)
+                or not _explicit_two_bed(s_norm)):
+            continue
+        p = _extract_price_usd(text)
+        if p is not None and not (USD_MIN <= p <= USD_MAX):
+            continue
+        if p is None and not _RE_CURRENCY_HINT.search(text):
+            continue  # no price signal at all, nothing for the LLM to recover
 
-            processed += 1
+        candidates.append((msg, msg_dt, text, p))
 
-            dec = llm_extract(text) or {}
-            if not isinstance(dec.get("price_usd"), (int,float)):
-                p = _extract_price_usd(text)
-                if p is not None:
-                    dec["price_usd"] = p
+    # LLM calls overlap; _LLM_SEM keeps at most OLLAMA_NUM_PARALLEL in flight across
+    # all channels, so the Ollama server's parallel slots stay full
+    decisions = await asyncio.gather(*(_decide(text, p) for _, _, text, p in candidates))
 
-            accept = True
-            s = text.lower()
-            if _has_one_plus_one(text): accept = False
-            if _detect_daily(text): accept = False
-            if _mentions(OUT_OF_BATUMI, text): accept = False
-            if _mentions(EXCLUDE_BUILDINGS, text): accept = False
-            if not _explicit_two_bed(text): accept = False
+    for (msg, msg_dt, text, _), dec in zip(candidates, decisions):
+        pr = dec.get("price_usd")
+        if not (isinstance(pr,(int,float)) and USD_MIN <= pr <= USD_MAX):
+            continue
 
-            pr = dec.get("price_usd")
-            if not (isinstance(pr,(int,float)) and USD_MIN <= pr <= USD_MAX):
-                accept = False
+        score = int(dec.get("score_10") or 5)
+        if _mentions(_RE_PRIORITY_STREETS, text):
+            score = min(10, score + 1)
 
-            if not accept:
-                continue
+        username = getattr(ch, "username", None)
+        url = f"https://t.me/{username}/{msg.id}" if username else None
 
-            score = int(dec.get("score_10") or 5)
-            if any(p in s for p in PRIORITY_STREETS):
-                score = min(10, score + 1)
-
-            username = getattr(ch, "username", None)
-            url = f"https://t.me/{username}/{msg.id}" if username else None
-
-            entry = Listing(
-                channel=title,
-                url=url,
-                message_id=msg.id,
-                date_local=msg_dt.astimezone(TBILISI_TZ).strftime("%Y-%m-%d %H:%M"),
-                price_usd=float(dec.get("price_usd") or 0.0),
-                score=score,
-                text=text,
-            )
-            _append_csv_row(CSV_PATH, entry)
-            kept += 1
+        entries.append(Listing(
+            channel=title,
+            url=url,
+            message_id=msg.id,
+            date_local=msg_dt.astimezone(TBILISI_TZ).strftime("%Y-%m-%d %H:%M"),
+            price_usd=float(dec.get("price_usd") or 0.0),
+            score=score,
+            text=text,
+        ))
+
+    log.info(f"Канал: {title} | обработано={processed}, прошло фильтр={len(entries)}")
+    return entries
 
-        log.info(f"Канал: {title} | обработано={processed}, прошло фильтр={kept}")
+async def collect(client: TelegramClient) -> None:
+    cutoff = dt.datetime.now(UTC) - dt.timedelta(days=LOOKBACK_DAYS)
+    _ensure_csv_header(CSV_PATH)
+    channels = await discover_channels(client)
+    sem = asyncio.Semaphore(COLLECT_PARALLEL_CHANNELS)
+    seen, last_ids = _load_seen(CSV_PATH, cutoff)
 
+    log.info(f"Сбор из {len(channels)} каналов, период {LOOKBACK_DAYS}д, только посты с фото")
+    with open(CSV_PATH, "a", newline="", encoding="utf-8", buffering=1 << 16) as f:
+        writer = csv.writer(f)
+
+        async def worker(ch: Channel) -> None:
+            # Every failure stays inside its worker: an exception escaping gather()
+            # would close the CSV while sibling channels are still running
+            try:
+                async with sem:
+                    entries = await _retry_flood_wait(
+                        lambda: _collect_channel(client, ch, cutoff, seen, last_ids), ch)
+                # No await between write and flush, so concurrent workers never interleave rows
+                writer.writerows(_csv_row(entry) for entry in entries)
+                f.flush()
+            except RPCError as e:
+                log.warning(f"Канал {ch.id} пропущен: {e}")
+            except Exception:
+                log.exception(f"Канал {ch.id} пропущен из-за ошибки")
+
+        await asyncio.gather(*(worker(ch) for ch in channels))
+
+    _export_parquet(CSV_PATH, PARQUET_PATH)
     log.info("Готово. Результат в matches.csv")
 
 def main():
@@ -312,7 +486,6 @@ def main():
 
     client = TelegramClient(SESSION, API_ID, API_HASH)
 
-    import asyncio
     async def run():
         await client.connect()
         if not await client.is_user_authorized():
@@ -328,6 +501,7 @@ def main():
             await collect(client)
         finally:
             await client.disconnect()
+            await _HTTP.aclose()
 
     asyncio.run(run())
 